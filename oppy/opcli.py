@@ -1,17 +1,23 @@
 """
     Define the CLI object.
 """
-import base64
 import cmd
 import getpass
 import json
 import logging
 import os
-import pickle
 import subprocess
 
-import cryptography.fernet as fernet
 import keyring
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import pygments
 import pygments.formatters as pyg_format
 import pygments.lexers as pyg_lexer
@@ -25,6 +31,27 @@ FORMAT = '%(asctime)s %(filename)s:%(lineno)d - %(message)s'
 logging.basicConfig(format=FORMAT)
 
 
+def _json_loads(data):
+    """ Parse JSON with orjson when available, stdlib json otherwise. """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(data):
+    """ Serialize data to compact JSON bytes. """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode('utf-8')
+
+
+def _json_pretty(data):
+    """ Serialize data to an indented JSON string. """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(data, indent=4, ensure_ascii=False)
+
+
 class LoginError(Exception):
     pass
 
@@ -40,6 +67,8 @@ class OnePasswordCLI(cmd.Cmd):
         self.do_setvault(config.get(profile, 'vault'))
         self.debug = config.getboolean(profile, 'debug')
         self.temp_file = config.get(profile, 'temp_file')
+        self._item_index = {}
+        self._base_env = dict(os.environ)
         logger.setLevel(logging.DEBUG if self.debug else logging.INFO)
 
     @property
@@ -69,14 +98,11 @@ class OnePasswordCLI(cmd.Cmd):
         return self.temp_file
 
     def _get_env(self):
-        """ Returns a copy of the current environment updated
+        """ Returns the environment captured at startup updated
         with the OnePassword session.
         """
-        environ = os.environ.copy()
-        environ.update({
-            'OP_SESSION_%s' % self.domain: self.op_session
-        })
-        return environ
+        return {**self._base_env,
+                'OP_SESSION_%s' % self.domain: self.op_session}
 
     def _ask_for_master_password(self, password=None):
         """ Ask for the OnePassword master key."""
@@ -85,11 +111,10 @@ class OnePasswordCLI(cmd.Cmd):
         return password
 
     def _get_encryption_key(self, size=32):
-        """ Compute the encryption key from OnePassword master key. """
-        password = bytes(self.op_session, 'utf-8')
-        # b'\xce' char make 1 character len
-        password = password[:size] + b'\xce' * (size - len(password))
-        return base64.encodebytes(password)
+        """ Derive the cache encryption key from the OnePassword session. """
+        kdf = HKDF(algorithm=hashes.SHA256(), length=size, salt=None,
+                   info=b'oppy-item-cache')
+        return kdf.derive(bytes(self.op_session, 'utf-8'))
 
     def _login(self):
         """ Do the OnePassword login and store the session. """
@@ -117,7 +142,8 @@ class OnePasswordCLI(cmd.Cmd):
         keyring.set_password('OnePasswordCLI',
                              'OP_SESSION_{}'.format(self.domain), out.strip())
         print('')
-        logger.debug(self.op_session)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(self.op_session)
         print('Login successful')
 
     def _save_to_tmp(self):
@@ -125,8 +151,10 @@ class OnePasswordCLI(cmd.Cmd):
         try:
             with open(self.tmp_file_name, 'wb+') as tmp:
                 # encrypt data
-                f = fernet.Fernet(self._get_encryption_key())
-                tmp.write(f.encrypt(pickle.dumps(self.items)))
+                aes = AESGCM(self._get_encryption_key())
+                nonce = os.urandom(12)
+                data = _json_dumps(list(self.items))
+                tmp.write(nonce + aes.encrypt(nonce, data, None))
         except (ValueError, TypeError, IOError) as exc:
             logger.debug(exc)
 
@@ -135,9 +163,12 @@ class OnePasswordCLI(cmd.Cmd):
         try:
             with open(self.tmp_file_name, 'rb') as tmp:
                 # decrypt data
-                f = fernet.Fernet(self._get_encryption_key())
-                self.items = pickle.loads(f.decrypt(tmp.read()))
-        except (fernet.InvalidToken, ValueError, TypeError, IOError, EOFError) as exc:
+                blob = tmp.read()
+                aes = AESGCM(self._get_encryption_key())
+                nonce, payload = blob[:12], blob[12:]
+                self.items = opdb.OpResponse(
+                    _json_loads(aes.decrypt(nonce, payload, None)))
+        except (InvalidTag, ValueError, TypeError, IOError, EOFError) as exc:
             logger.debug(exc)
             try:
                 os.remove(self.tmp_file_name)
@@ -158,23 +189,38 @@ class OnePasswordCLI(cmd.Cmd):
             cmd = ['op', 'list', 'items']
             if self.vault:
                 cmd += ['--vault=%s' % self.vault]
+            # keep the output as bytes: the JSON parser takes them
+            # directly, which skips decoding the whole vault dump
             process = subprocess.Popen(args=cmd,
                                        env=self._get_env(),
-                                       encoding='utf-8',
                                        stdout=subprocess.PIPE,
                                        stderr=subprocess.PIPE)
             out, err = process.communicate()
             if out:
                 self.items = opdb.OpResponse(
-                    json.loads(out))
+                    _json_loads(out))
                 self._save_to_tmp()
             else:
                 self.items = opdb.OpResponse()
                 self._save_to_tmp()
+        self._item_index = {obj['uuid']: obj for obj in self.items}
         return self.items
 
-    def _get_item(self, uuid):
-        """ Get one item from its UUID.
+    def _get_overview(self, uuid):
+        """ Get the cached overview of an item from its UUID, without
+        spawning an op subprocess.
+
+        :type uuid: str
+        :param uuid: the item unique identifier
+        :returns: dict -- the cached item, or None if unknown
+        """
+        return self._item_index.get(uuid)
+
+    def _get_credentials(self, uuid):
+        """ Get one item with its credentials from its UUID.
+
+        This is the expensive path: it spawns an op subprocess, so it
+        should only be called when the secrets are actually needed.
 
         :type uuid: str
         :param uuid: the item unique identifier
@@ -186,27 +232,27 @@ class OnePasswordCLI(cmd.Cmd):
         cmd += [uuid]
         process = subprocess.Popen(args=cmd,
                                    env=self._get_env(),
-                                   encoding='utf-8',
                                    stdout=subprocess.PIPE,
                                    stderr=subprocess.PIPE)
         out, err = process.communicate()
         if out:
-            raw_item = json.loads(out)
+            raw_item = _json_loads(out)
             item = {'uuid': raw_item['uuid']}
             if 'title' in raw_item.get('overview', {}):
                 item['title'] = raw_item['overview']['title']
             if 'url' in raw_item.get('overview', {}):
                 item['url'] = raw_item['overview']['url']
-            username_fields = [field for field in raw_item.get('details', {})
-                                                          .get('fields')
-                               if field.get('designation') == 'username']
-            if username_fields:
-                item['username'] = username_fields[0]['value']
-            password_fields = [field for field in raw_item.get('details', {})
-                                                          .get('fields')
-                               if field.get('designation') == 'password']
-            if password_fields:
-                item['password'] = password_fields[0]['value']
+            username = password = None
+            for field in raw_item.get('details', {}).get('fields') or ():
+                designation = field.get('designation')
+                if designation == 'username' and username is None:
+                    username = field['value']
+                elif designation == 'password' and password is None:
+                    password = field['value']
+            if username is not None:
+                item['username'] = username
+            if password is not None:
+                item['password'] = password
             # look for totp
             for section in raw_item.get('details', {}).get('sections', []):
                 for field in section.get('fields', []):
@@ -217,7 +263,7 @@ class OnePasswordCLI(cmd.Cmd):
                         break
             return item
         if err:
-            logger.error(err)
+            logger.error(err.decode('utf-8', 'replace'))
 
     def _get_item_totp(self, uuid):
         """ Get the TOTP on an item from its UUID.
@@ -286,7 +332,7 @@ class OnePasswordCLI(cmd.Cmd):
     def print_json(self, data):
         """ Format the json before outputing it. """
         if data:
-            data = json.dumps(data, indent=4, ensure_ascii=False)
+            data = _json_pretty(data)
             print(pygments.highlight(data, pyg_lexer.JsonLexer(),
                                      pyg_format.Terminal256Formatter()))
 
@@ -316,7 +362,12 @@ class OnePasswordCLI(cmd.Cmd):
 
     def do_get(self, arg):
         """ Get a specific item using its uuid, title or domain. """
-        self.print_json(self._get_item(arg))
+        item = self._get_credentials(arg)
+        if item is None:
+            # op could not serve the item: fall back to the cached
+            # overview so a stale session still shows something useful
+            item = self._get_overview(arg)
+        self.print_json(item)
 
     def do_search(self, tql):
         """ Find items matching the tql given as argument. """
@@ -355,7 +406,7 @@ class OnePasswordCLI(cmd.Cmd):
                 except IndexError:
                     user_choice = None
         # output the item
-        self.print_json(self._get_item(item['uuid']))
+        self.print_json(self._get_credentials(item['uuid']))
 
     def do_totp(self, arg):
         """ Get the TOTP for a specitif item """
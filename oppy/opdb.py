@@ -1,44 +1,36 @@
 #! /usr/bin/python3
-import ply.yacc as yacc
-
-from oppy.opparser import (OpTqlParser, OpFilter, OpFuzzy,
+import oppy.opparser as opparser
+from oppy.opparser import (OpFilter, OpFuzzy,
                            OpUnionOperator, OpIntersectionOperator)
 
 
 class OpResponse(object):
     def __init__(self, copy_from=None):
-        if copy_from is None:
-            self._objects = []
-        else:
-            self._objects = [obj for obj in copy_from]
+        # insertion-ordered dict keyed by uuid: O(1) membership instead
+        # of comparing dicts field by field on every lookup
+        self._objects = {}
+        if copy_from is not None:
+            for obj in copy_from:
+                self.add(obj)
 
     def __repr__(self):
-        names = (obj.get('uuid') for obj in self._objects)
-        return '<OpResponse [%s]>' % ', '.join(names)
+        return '<OpResponse [%s]>' % ', '.join(self._objects)
 
     def __iter__(self):
-        return iter(self._objects)
+        return iter(self._objects.values())
 
     def __contains__(self, obj):
-        return obj in self._objects
+        return obj['uuid'] in self._objects
 
     def __and__(self, other):
         response = OpResponse()
-        for obj in self:
-            if obj in other:
-                obj = obj.copy()
-                response.add(obj)
+        response._objects = {uuid: obj for uuid, obj in self._objects.items()
+                             if uuid in other._objects}
         return response
 
     def __or__(self, other):
         response = OpResponse()
-        for obj in other:
-            if obj in self:
-                obj = obj.copy()
-            response.add(obj)
-        for obj in self:
-            if obj not in response:
-                response.add(obj)
+        response._objects = {**other._objects, **self._objects}
         return response
 
     def __len__(self):
@@ -55,17 +47,22 @@ class OpResponse(object):
         return d
 
     def _find_value(self, obj_values, cmp_func):
-        """ Raise ValueError if obj has not the value. """
-        for val in obj_values:
-            if isinstance(val, (int, float, str)):
+        """ Return True if any nested scalar satisfies cmp_func.
+
+        The walk is iterative with exact type checks: no recursive call
+        per container and no MRO lookup per value.
+        """
+        stack = list(obj_values)
+        while stack:
+            val = stack.pop()
+            kind = type(val)
+            if kind is str or kind is int or kind is float:
                 if cmp_func(val):
                     return True
-            elif isinstance(val, dict):
-                if self._find_value(val.values(), cmp_func):
-                    return True
-            elif isinstance(val, (tuple, list)):
-                if self._find_value(val, cmp_func):
-                    return True
+            elif kind is dict:
+                stack.extend(val.values())
+            elif kind is list or kind is tuple:
+                stack.extend(val)
         return False
 
     def filter(self, tag, cmp_func):
@@ -93,52 +90,103 @@ class OpResponse(object):
         """ Add an object in the response.
         :param obj: the object to add to the response
         """
-        if obj not in self._objects:
-            self._objects.append(obj)
+        self._objects.setdefault(obj['uuid'], obj)
 
 
 class OpDatabase(object):
     def __init__(self, objects):
         self._objects = objects
+        self._by_uuid = {obj['uuid']: obj for obj in objects}
+        self._tag_index = {}
+        self._fuzzy_haystack = None
+        self._dispatch = {
+            OpFilter: self._evaluate_filter,
+            OpFuzzy: self._evaluate_fuzzy,
+            OpUnionOperator: self._evaluate_union,
+            OpIntersectionOperator: self._evaluate_intersection
+        }
+
+    def _index_for_tag(self, tag):
+        """ Lazily build the list of (uuid, value) pairs for a tag,
+        so the nested dict walk is done once per tag instead of once
+        per object per filter evaluation.
+        """
+        try:
+            return self._tag_index[tag]
+        except KeyError:
+            keys = tag.split('.')
+            index = []
+            for uuid, obj in self._by_uuid.items():
+                value = obj
+                try:
+                    for key in keys:
+                        value = value[key]
+                except KeyError:
+                    continue
+                index.append((uuid, value))
+            self._tag_index[tag] = index
+            return index
+
+    def _flatten_scalars(self, values, out):
+        """ Collect every scalar of a nested structure as a string. """
+        for val in values:
+            if isinstance(val, (int, float, str)):
+                out.append(str(val))
+            elif isinstance(val, dict):
+                self._flatten_scalars(val.values(), out)
+            elif isinstance(val, (tuple, list)):
+                self._flatten_scalars(val, out)
+
+    def _fuzzy_index(self):
+        """ Lazily build one haystack string per object, joining all its
+        scalars with a sentinel separator. A fuzzy term is then matched
+        with a single scan per object instead of one per field.
+        """
+        if self._fuzzy_haystack is None:
+            self._fuzzy_haystack = {}
+            for uuid, obj in self._by_uuid.items():
+                scalars = []
+                self._flatten_scalars(obj.values(), scalars)
+                self._fuzzy_haystack[uuid] = '\x1f'.join(scalars)
+        return self._fuzzy_haystack
 
     def raw_query(self, tql):
         if isinstance(tql, str):
-            tql = OpTqlParser(tql, debug=False, write_tables=False,
-                              errorlog=yacc.NullLogger()).parse()
+            tql = opparser.parse_tql(tql)
             evaluated = self._evaluate_ast(tql)
         elif tql is None:
             evaluated = OpResponse(self._objects)
         return evaluated
 
-    # TQL AST evaluation:
+    # TQL AST evaluation: every node computes a set of matching uuids,
+    # and the matched objects are materialized once at the top instead
+    # of building an intermediate OpResponse per node.
     #
     def _evaluate_ast(self, ast):
-        objects = OpResponse(self._objects)
-        return self._evaluate_expression(objects, ast.expression)
-
-    def _evaluate_expression(self, objects, expression):
-        if isinstance(expression, OpFilter):
-            return self._evaluate_filter(objects, expression)
-        elif isinstance(expression, OpFuzzy):
-            return self._evaluate_fuzzy(objects, expression)
-        elif isinstance(expression, OpUnionOperator):
-            return self._evaluate_union(objects, expression)
-        elif isinstance(expression, OpIntersectionOperator):
-            return self._evaluate_intersection(objects, expression)
-
-    def _evaluate_filter(self, objects, filter):
-        return objects.filter(filter.name, filter.match)
-
-    def _evaluate_fuzzy(self, objects, filter):
-        return objects.fuzzy(filter.match)
-
-    def _evaluate_union(self, objects, union):
-        left = self._evaluate_expression(objects, union.left_expression)
-        right = self._evaluate_expression(objects, union.right_expression)
-        return left | right
-
-    def _evaluate_intersection(self, objects, intersection):
-        left = self._evaluate_expression(objects, intersection.left_expression)
-        right = self._evaluate_expression(objects,
-                                          intersection.right_expression)
-        return left & right
+        uuids = self._evaluate_expression_uuids(ast.expression)
+        matching = OpResponse()
+        for uuid, obj in self._by_uuid.items():
+            if uuid in uuids:
+                matching.add(obj)
+        return matching
+
+    def _evaluate_expression_uuids(self, expression):
+        return self._dispatch[type(expression)](expression)
+
+    def _evaluate_filter(self, filter):
+        return {uuid for uuid, value in self._index_for_tag(filter.name)
+                if filter.match(value)}
+
+    def _evaluate_fuzzy(self, filter):
+        return {uuid for uuid, haystack in self._fuzzy_index().items()
+                if filter.match(haystack)}
+
+    def _evaluate_union(self, union):
+        return (self._evaluate_expression_uuids(union.left_expression) |
+                self._evaluate_expression_uuids(union.right_expression))
+
+    def _evaluate_intersection(self, intersection):
+        return (self._evaluate_expression_uuids(
+                    intersection.left_expression) &
+                self._evaluate_expression_uuids(
+                    intersection.right_expression))
@@ -1,8 +1,29 @@
 #! /usr/bin/python3
-import ply.lex as lex
+
+
+class LexToken(object):
+    """ Minimal token object shaped like ply.lex.LexToken. """
+    __slots__ = ('type', 'value', 'lineno', 'lexpos', 'lexer')
+
+    def __init__(self, type_, value, lineno, lexpos):
+        self.type = type_
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+
+    def __repr__(self):
+        return 'LexToken({},{!r},{},{})'.format(self.type, self.value,
+                                                self.lineno, self.lexpos)
 
 
 class OpTqlLexer(object):
+    """ Hand-written tokenizer for the TQL grammar.
+
+    The grammar only has eight token kinds, so a direct character scan
+    is much cheaper than running a regex per token rule. The tokens are
+    exposed through the usual input()/token() interface expected by the
+    parser.
+    """
     tokens = (
         'NUMBER',
         'STRING',
@@ -13,46 +34,73 @@ class OpTqlLexer(object):
         'LPAREN',
         'RPAREN'
     )
-    t_NAME = r'[a-zA-Z\.]+'
-    t_AND = r'&'
-    t_OR = r'\|'
-    t_EQUALS = r'='
-    t_LPAREN = r'\('
-    t_RPAREN = r'\)'
 
-    # A string containing ignored characters (spaces and tabs)
-    t_ignore = ' \t'
+    _SIMPLE = {'&': 'AND', '|': 'OR', '=': 'EQUALS',
+               '(': 'LPAREN', ')': 'RPAREN'}
+    _NAME_CHARS = frozenset(
+        'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ.')
+    _DIGITS = frozenset('0123456789')
 
     def __init__(self, **kwargs):
-        self._lexer = lex.lex(module=self, **kwargs)
+        self._tokens = []
+        self._next = 0
 
-    def t_NUMBER(self, t):
-        r'\d+'
-        t.value = int(t.value)
-        return t
-
-    def t_STRING(self, t):
-        r'"[a-zA-Z0-9\- \*:/\.]+"'
-        t.value = t.value.strip('"')
-        return t
+    def input(self, _input):
+        self._current_input = _input
+        self._tokens = self._tokenize(_input)
+        self._next = 0
 
-    def t_newline(self, t):
-        r'\n+'
-        t.lexer.lineno += len(t.value)
+    def token(self):
+        """ Return the next token, or None when the input is consumed. """
+        try:
+            tok = self._tokens[self._next]
+        except IndexError:
+            return None
+        self._next += 1
+        return tok
 
-    def t_error(self, t):
-        print("Illegal character '%s'" % t.value[0])
-        t.lexer.skip(1)
+    def __iter__(self):
+        return iter(self._tokens[self._next:])
 
-    def input(self, _input):
-        self._current_input = _input
-        return self._lexer.input(_input)
-
-    def __getattr__(self, name):
-        lexer = super(OpTqlLexer, self).__getattribute__('_lexer')
-        attr = getattr(lexer, name)
-        if attr is None:
-            raise AttributeError("'%s' object has no attribute '%s'" % (self,
-                                                                        name))
-        else:
-            return attr
+    def _tokenize(self, _input):
+        tokens = []
+        simple = self._SIMPLE
+        name_chars = self._NAME_CHARS
+        digits = self._DIGITS
+        lineno = 1
+        i, end = 0, len(_input)
+        while i < end:
+            char = _input[i]
+            if char in ' \t':
+                i += 1
+            elif char in simple:
+                tokens.append(LexToken(simple[char], char, lineno, i))
+                i += 1
+            elif char == '"':
+                closing = _input.find('"', i + 1)
+                if closing == -1:
+                    print("Illegal character '%s'" % char)
+                    i += 1
+                    continue
+                tokens.append(LexToken('STRING', _input[i + 1:closing],
+                                       lineno, i))
+                i = closing + 1
+            elif char in digits:
+                start = i
+                while i < end and _input[i] in digits:
+                    i += 1
+                tokens.append(LexToken('NUMBER', int(_input[start:i]),
+                                       lineno, start))
+            elif char in name_chars:
+                start = i
+                while i < end and _input[i] in name_chars:
+                    i += 1
+                tokens.append(LexToken('NAME', _input[start:i],
+                                       lineno, start))
+            elif char == '\n':
+                lineno += 1
+                i += 1
+            else:
+                print("Illegal character '%s'" % char)
+                i += 1
+        return tokens
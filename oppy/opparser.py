@@ -1,5 +1,5 @@
 #! /usr/bin/python3
-import ply.yacc as yacc
+import functools
 import re
 
 from oppy.oplex import OpTqlLexer
@@ -14,31 +14,52 @@ class OpTqlAst(object):
         self.expression = expression
 
 
+@functools.lru_cache(maxsize=1024)
+def _compile_glob(value, ignore_case):
+    """ Compile a glob value to a regex pattern, cached per session so
+    repeated queries never recompile the same filter.
+    """
+    pattern = re.escape(value).replace(r'\*', '.*')
+    return re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+
+
 class OpFilter(object):
     def __init__(self, name, value=None):
         self.name = name
-        self.value = '^' + str(value).replace('*', '.*') + '$'
+        self.value = str(value)
+        if '*' not in self.value:
+            # no wildcard: a plain equality beats the regex engine
+            self.match = (lambda v, w=self.value:
+                          v is not None and str(v) == w)
+        else:
+            self._pattern = _compile_glob(self.value, False)
 
     def __repr__(self):
         return '{}={}'.format(self.name, self.value)
 
     def match(self, value):
         if value is None:
-            return self.value is None
-        return re.match(self.value, value) is not None
+            return False
+        return self._pattern.fullmatch(str(value)) is not None
 
 
 class OpFuzzy(object):
     def __init__(self, value):
-        self.value = '^' + str(value).replace('*', '.*') + '$'
+        self.value = str(value)
+        if '*' not in self.value:
+            # no wildcard: a substring test beats the regex engine
+            self.match = (lambda v, w=self.value.lower():
+                          v is not None and w in str(v).lower())
+        else:
+            self._pattern = _compile_glob(self.value, True)
 
     def __repr__(self):
         return '{}'.format(self.value)
 
     def match(self, value):
         if value is None:
-            return self.value is None
-        return re.match(self.value, '{}'.format(value), re.IGNORECASE) is not None
+            return False
+        return self._pattern.search('{}'.format(value)) is not None
 
 
 class OpBinaryOperator(object):
@@ -62,63 +83,94 @@ class OpIntersectionOperator(OpBinaryOperator):
 
 
 class OpTqlParser(object):
-    """Parser for TQL grammar
+    """ Recursive-descent parser for the TQL grammar.
+
+    The grammar has a handful of productions and one precedence level,
+    so a direct descent over the token stream does the job without any
+    parser-generator machinery:
+
+        expr : expr OR expr
+             | expr AND expr
+             | NAME EQUALS STRING
+             | NAME EQUALS NUMBER
+             | LPAREN expr RPAREN
+             | STRING | NAME | NUMBER
     """
-    tokens = OpTqlLexer.tokens
-
-    precedence = (('left', 'OR', 'AND'),)
 
-    def __init__(self, _input, **kwargs):
+    def __init__(self, _input, lexer=None):
         self._input = _input
-        self._lexer = kwargs.pop('lexer', OpTqlLexer())
-        self._parser = yacc.yacc(module=self, **kwargs)
-
-    start = 'input'
+        self._lexer = lexer if lexer is not None else OpTqlLexer()
+        self._token = None
 
-    def p_input(self, p):
-        """input : expr"""
-        if len(p) == 1:
-            p[0] = OpTqlAst()
-        else:
-            p[0] = OpTqlAst(p[1])
-
-    def p_expr_fuzzy(self, p):
-        """ expr : STRING
-                 | NAME
-                 | NUMBER """
-        p[0] = OpFuzzy(p[1])
-
-    def p_expr_pair(self, p):
-        """expr : NAME EQUALS STRING
-                | NAME EQUALS NUMBER"""
-        p[0] = OpFilter(p[1], p[3])
-
-    def p_expr_par(self, p):
-        """expr : LPAREN expr RPAREN"""
-        p[0] = p[2]
-
-    def p_expr_binary(self, p):
-        """expr : expr OR expr
-                | expr AND expr"""
-        if p[2] == '|':
-            p[0] = OpUnionOperator(p[1], p[3])
-        elif p[2] == '&':
-            p[0] = OpIntersectionOperator(p[1], p[3])
-
-    def p_error(self, token):
+    def parse(self):
+        self._lexer.input(self._input)
+        self._token = self._lexer.token()
+        expression = self._expr()
+        if self._token is not None:
+            self._error(self._token)
+        return OpTqlAst(expression)
+
+    def _advance(self):
+        token = self._token
+        self._token = self._lexer.token()
+        return token
+
+    def _error(self, token):
         if token is None:
             raise ParsingError('Syntax error near of "EOL"')
         else:
             raise ParsingError('Syntax error near of "%s"' % token.value)
 
-    def parse(self):
-        return self._parser.parse(self._input, self._lexer, tracking=True)
-
-    def __getattr__(self, name):
-        parser = super(OpTqlParser, self).__getattribute__('_parser')
-        attr = getattr(parser, name)
-        if attr is None:
-            raise AttributeError("'%s' object has no attribute '%s'" % (self,
-                                                                        name))
-        else:
-            return attr
+    def _expr(self):
+        # OR and AND share a single left-associative precedence level
+        left = self._primary()
+        while self._token is not None and self._token.type in ('OR', 'AND'):
+            operator = self._advance()
+            right = self._primary()
+            if operator.type == 'OR':
+                left = OpUnionOperator(left, right)
+            else:
+                left = OpIntersectionOperator(left, right)
+        return left
+
+    def _primary(self):
+        token = self._token
+        if token is None:
+            self._error(token)
+        if token.type == 'LPAREN':
+            self._advance()
+            expression = self._expr()
+            if self._token is None or self._token.type != 'RPAREN':
+                self._error(self._token)
+            self._advance()
+            return expression
+        if token.type == 'NAME':
+            self._advance()
+            if self._token is not None and self._token.type == 'EQUALS':
+                self._advance()
+                value = self._token
+                if value is None or value.type not in ('STRING', 'NUMBER'):
+                    self._error(value)
+                self._advance()
+                return OpFilter(token.value, value.value)
+            return OpFuzzy(token.value)
+        if token.type in ('STRING', 'NUMBER'):
+            self._advance()
+            return OpFuzzy(token.value)
+        self._error(token)
+
+
+def parse(tql):
+    """ Parse a TQL string. """
+    return OpTqlParser(tql).parse()
+
+
+@functools.lru_cache(maxsize=256)
+def parse_tql(tql):
+    """ Parse a TQL string, caching the resulting AST.
+
+    The AST is never mutated after construction, so repeated queries
+    (e.g. the same search run twice) can share it and skip the
+    lex/parse work entirely.
+    """
+    return parse(tql)
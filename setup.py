@@ -22,7 +22,7 @@ setup(
     ],
     keywork='One Password, password manager',
     packages=find_packages(),
-    install_requires=['cryptography', 'dbus-python', 'ply',
+    install_requires=['cryptography', 'dbus-python',
                       'keyring', 'Pygments', 'SecretStorage'],
     entry_points={
         'console_scripts': [